@@ -1,13 +1,20 @@
-import os, shutil, cv2, json
-from typing import List
+import os, json
+from typing import List, Optional
+from urllib.parse import quote
 from fastapi import FastAPI, UploadFile, HTTPException, Body, File
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
+from PIL import Image
 
-from src.ocr import ocr_image
+from src.ocr import ocr_image, crop_stats
 from src.extract_rules import extract_with_text
-from src.storage import save_confirmed, save_correction, load_correction
-from evaluate import evaluate_all
+from src.dedup import (save_upload, perceptual_hash, find_near_duplicate, load_cached_ocr,
+                       save_cached_ocr, page_tokens)
+from src.annotate import FORMATS, render_annotation, bbox_overlay, tile_grid
+from src.templates import extract_from_template, learn_template, template_stats
+from src.artifacts import flush, write_error, artifact_stats
+from src.storage import FINAL_DIR, save_confirmed, save_correction, load_correction, load_confirmed, save_pages, load_pages
+from evaluate import start_job, load_job, latest_job, mark_interrupted
 
 app = FastAPI(title="Lab Report Digitization API")
 
@@ -22,38 +29,6 @@ async def root():
 UPLOAD_DIR = "data/samples"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-def annotate_image(image_path, tokens, parsed):
-    """Highlight only exact matched tokens from parsing."""
-    img = cv2.imread(image_path)
-    if img is None:
-        raise RuntimeError(f"Failed to load image: {image_path}")
-
-    h, w = img.shape[:2]
-    highlight_tokens = []
-
-    # Patient fields
-    if parsed.get("patient"):
-        for v in parsed["patient"].values():
-            if v and v != "UNKNOWN":
-                highlight_tokens.append(str(v))
-
-    # Test tokens
-    for t in parsed.get("tests", []):
-        if "matched_tokens" in t:
-            highlight_tokens.extend(t["matched_tokens"])
-
-    # Draw rectangles
-    for t in tokens:
-        if any(ht.lower() == t["text"].lower() for ht in highlight_tokens):
-            x0, y0, x1, y1 = t["bbox"]
-            x0, y0, x1, y1 = int(x0 * w), int(y0 * h), int(x1 * w), int(y1 * h)
-            cv2.rectangle(img, (x0, y0), (x1, y1), (0, 255, 0), 2)
-
-    out_path = f"data/debug/annotated_{os.path.basename(image_path)}"
-    os.makedirs("data/debug", exist_ok=True)
-    cv2.imwrite(out_path, img)
-    return out_path
-
 @app.post("/upload")
 async def upload(files: List[UploadFile] = File(...)):
     try:
@@ -62,28 +37,57 @@ async def upload(files: List[UploadFile] = File(...)):
 
         saved_pages = []
         combined_texts = []
+        duplicates = []
 
         for upload_file in files:
-            file_path = os.path.join(UPLOAD_DIR, upload_file.filename)
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(upload_file.file, buffer)
-
-            try:
-                tokens, full_text = ocr_image(file_path)
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=f"OCR failed for {upload_file.filename}: {str(e)}")
+            # Hash while streaming; identical bytes resolve to the earlier copy
+            file_path, digest = save_upload(upload_file.file, UPLOAD_DIR, upload_file.filename)
+
+            same = next((p for p in saved_pages if p["sha256"] == digest), None)
+            if same:
+                duplicates.append({"filename": upload_file.filename, "duplicate_of": same["filename"]})
+                continue
+
+            # Near-duplicate pages within the bundle are never OCR'd twice
+            cached = load_cached_ocr(digest)
+            phash = cached["phash"] if cached else perceptual_hash(file_path)
+            near = find_near_duplicate(phash, saved_pages, file_path)
+            if near:
+                duplicates.append({"filename": upload_file.filename, "duplicate_of": near["filename"]})
+                continue
+
+            ocr_stats = {}
+            if cached:
+                tokens, full_text = cached["tokens"], cached["text"]
+                ocr_stats["cached"] = True
+            else:
+                try:
+                    tokens, full_text = ocr_image(file_path, ocr_stats)
+                except Exception as e:
+                    raise HTTPException(status_code=500, detail=f"OCR failed for {upload_file.filename}: {str(e)}")
+                save_cached_ocr(digest, file_path, phash, tokens, full_text)
 
             saved_pages.append({
                 "filename": upload_file.filename,
+                "page": os.path.basename(file_path),
                 "path": file_path,
+                "sha256": digest,
+                "phash": phash,
                 "tokens": tokens,
+                "ocr_stats": ocr_stats,
             })
             combined_texts.append(full_text)
 
         combined_text = "\n\n".join(text for text in combined_texts if text)
 
-        # Extract structured data on combined text
-        parsed = extract_with_text(combined_text)
+        # Known single-page layouts take the positional fast path
+        parsed = None
+        if len(saved_pages) == 1:
+            parsed = extract_from_template(saved_pages[0]["tokens"])
+
+        # Otherwise extract structured data on combined text
+        if parsed is None:
+            parsed = extract_with_text(combined_text)
 
         # Determine document identifier
         base_name = os.path.splitext(files[0].filename)[0]
@@ -96,26 +100,26 @@ async def upload(files: List[UploadFile] = File(...)):
         if corrected:
             parsed = corrected
 
-        # Annotate each page
+        # Annotations are rendered lazily by /annotations when requested
         annotated_images = []
         for page in saved_pages:
-            try:
-                annotated_path = annotate_image(page["path"], page["tokens"], parsed)
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=f"Annotation failed for {page['filename']}: {str(e)}")
-
+            url = f"/annotations/{quote(base_name)}/{quote(page['page'])}"
             annotated_images.append({
                 "filename": page["filename"],
-                "image": f"/data/debug/{os.path.basename(annotated_path)}"
+                "image": url,
+                "overlay": f"{url}?format=json",
+                "ocr_stats": page["ocr_stats"],
             })
 
         # Save structured JSON for the bundle
         save_confirmed(bundle_filename, parsed)
+        save_pages(bundle_filename, [page["path"] for page in saved_pages])
 
         return {
             "status": "ok",
             "file": bundle_filename,
             "files": [page["filename"] for page in saved_pages],
+            "duplicates": duplicates,
             "raw_text": combined_text,
             "extracted": parsed,
             "images": annotated_images
@@ -125,20 +129,124 @@ async def upload(files: List[UploadFile] = File(...)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Processing failed: {str(e)}")
 
-@app.get("/evaluate")
-async def evaluate():
+@app.get("/annotations/{report}/{page}")
+def annotation(report: str, page: str, format: str = "png",
+               max_side: Optional[int] = None, tile: Optional[str] = None):
+    """
+    Serve the annotated page for a report, rendered on first request and cached.
+    format: png | webp | jpeg, or json for a bbox overlay drawn client-side.
+    max_side downscales the preview; tile="row,col" returns one TILE_SIZE tile.
+    """
+    if max_side is not None and max_side <= 0:
+        raise HTTPException(status_code=400, detail=f"max_side must be positive, got {max_side}")
+    # Pages live wherever the report was built from (uploads, ingest work dirs)
+    page = os.path.basename(page)
+    pages = load_pages(f"{report}.json") or []
+    image_path = next((p for p in pages if os.path.basename(p) == page), None)
+    if image_path is None or not os.path.exists(image_path):
+        raise HTTPException(status_code=404, detail=f"Page not found: {page}")
+
+    parsed = load_correction(f"{report}.json") or load_confirmed(f"{report}.json")
+    if parsed is None:
+        raise HTTPException(status_code=404, detail=f"Report not found: {report}")
+    tokens = page_tokens(image_path)
+    if tokens is None:
+        raise HTTPException(status_code=404, detail=f"No OCR tokens for page: {page}")
+
+    if format == "json":
+        with Image.open(image_path) as img:
+            width, height = img.size
+        return {
+            "page": page,
+            "grid": tile_grid(width, height, max_side),
+            "boxes": bbox_overlay(tokens, parsed),
+        }
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {format}")
+
+    tile_rc = None
+    if tile:
+        try:
+            row, col = (int(v) for v in tile.split(","))
+            tile_rc = (row, col)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid tile: {tile}")
+
+    try:
+        path, media_type = render_annotation(image_path, tokens, parsed, format, max_side, tile_rc)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Annotation failed for {page}: {str(e)}")
+    return FileResponse(path, media_type=media_type)
+
+@app.on_event("startup")
+def recover_jobs():
+    # Evaluation threads do not survive a restart
+    mark_interrupted()
+
+@app.post("/evaluate")
+async def evaluate(variants: Optional[List[str]] = Body(default=None, embed=True),
+                   workers: Optional[int] = Body(default=None, embed=True)):
+    """Start a background evaluation job (or return the one already running)."""
     try:
-        return evaluate_all()
+        return start_job(variants, workers)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Evaluation failed: {str(e)}")
 
+@app.get("/evaluate")
+async def evaluate_latest():
+    job = latest_job()
+    if job is None:
+        raise HTTPException(status_code=404, detail="No evaluation has been run yet")
+    return job
+
+@app.get("/evaluate/{job_id}")
+async def evaluate_status(job_id: str):
+    job = load_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Evaluation job not found: {job_id}")
+    return job
+
 @app.post("/correct")
-async def correct(filename: str = Body(...), corrected: dict = Body(...)):
+def correct(filename: str = Body(...), corrected: dict = Body(...)):
     """
     Save corrected JSON from frontend HITL form
     """
     try:
         path = save_correction(filename, corrected)
-        return {"status": "ok", "path": path}
+        # Writes are queued; wait so a failed write is reported instead of lost.
+        # save_correction also rewrites the final report, which must land too.
+        flush()
+        final_path = os.path.join(FINAL_DIR, f"{os.path.splitext(filename)[0]}.json")
+        errors = [e for e in (write_error(p, fmt="pretty") for p in (path, final_path)) if e]
+        if errors:
+            raise RuntimeError("; ".join(errors))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Correction failed: {str(e)}")
+
+    # Learn the layout of single-page reports for the template fast path
+    template_id = None
+    pages = load_pages(filename) or []
+    if len(pages) == 1:
+        tokens = page_tokens(pages[0])
+        if tokens:
+            try:
+                template_id = learn_template(tokens, corrected)
+            except Exception:
+                template_id = None
+    return {"status": "ok", "path": path, "template": template_id}
+
+@app.get("/templates/stats")
+async def templates_stats():
+    return template_stats()
+
+@app.get("/ocr/stats")
+async def ocr_crop_stats():
+    return crop_stats()
+
+@app.get("/artifacts/stats")
+async def artifacts_stats():
+    return artifact_stats()
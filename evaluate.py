@@ -1,11 +1,20 @@
-import os, json
+import os, json, copy, time, uuid, threading
+import multiprocessing as mp
 from glob import glob
-from src.ocr import ocr_image
+from concurrent.futures import ProcessPoolExecutor
 from src.extract_rules import extract_with_text, parse_patient_info, parse_tests
+from src.inference import run_model_inference
+from src.templates import extract_from_template
+from src.dedup import file_sha256, load_cached_ocr, save_cached_ocr, perceptual_hash
+from src.artifacts import flush
+from src.workers import init_worker
 from src.schemas import Report
+from src.vocab import lookup
 
 EXPECTED_DIR = "data/samples"
 RESULTS_DIR = "data/final_reports"
+EVAL_DIR = "data/eval_results"
+os.makedirs(EVAL_DIR, exist_ok=True)
 
 def safe_load(path):
     try:
@@ -21,14 +30,23 @@ def compare_dicts(expected, actual):
         results[key] = (str(exp_val).lower() == str(act_val).lower())
     return results
 
+def _test_key(test):
+    """Canonical vocabulary id when the name resolves, else the lowercase name."""
+    if test.get("canonical_id"):
+        return test["canonical_id"]
+    hit = lookup(test.get("name", ""), test.get("unit", ""))
+    return hit["id"] if hit else str(test.get("name", "")).lower()
+
 def compare_tests(expected_tests, actual_tests):
     results = []
     total = len(expected_tests)
+    actual_keys = [_test_key(act) for act in actual_tests]
 
     for exp in expected_tests:
         found = False
-        for act in actual_tests:
-            if exp["name"].lower() == act["name"].lower():
+        exp_key = _test_key(exp)
+        for act, act_key in zip(actual_tests, actual_keys):
+            if exp_key == act_key:
                 same_val = str(exp.get("value")).lower() == str(act.get("value", "")).lower()
                 same_unit = str(exp.get("unit")).lower() == str(act.get("unit", "")).lower()
                 results.append({
@@ -48,67 +66,193 @@ def compare_tests(expected_tests, actual_tests):
     score = sum(1 for r in results if r["value_match"] and r["unit_match"]) / max(1, total)
     return results, score
 
-def evaluate_all():
-    summary = {}
-    expected_files = glob(os.path.join(EXPECTED_DIR, "*_expected.json"))
+def sample_ocr(img_file):
+    """OCR tokens + text for a sample, reusing the content-hash OCR cache."""
+    digest = file_sha256(img_file)
+    cached = load_cached_ocr(digest)
+    if cached:
+        return cached["tokens"], cached["text"]
+    from src.ocr import ocr_image  # only loaded when a sample is not cached yet
+    tokens, raw_text = ocr_image(img_file)
+    save_cached_ocr(digest, img_file, perceptual_hash(img_file), tokens, raw_text)
+    flush()  # pool workers exit without running atexit hooks
+    return tokens, raw_text
 
-    for exp_file in expected_files:
-        base = os.path.basename(exp_file).replace("_expected.json", "")
-        expected = safe_load(exp_file)
+# -----------------------------------
+# Extractor variants
+# -----------------------------------
+def _normalized(report):
+    try:
+        return Report(**report).dict()  # normalize via schema
+    except Exception:
+        return report
 
-        if not expected:
-            summary[base] = {"status": "missing"}
-            continue
+def extract_regex(tokens, raw_text):
+    patient, _ = parse_patient_info(raw_text, tokens)
+    return {"patient": patient, "tests": parse_tests(raw_text, tokens)}
+
+def extract_hybrid(tokens, raw_text):
+    """Regex + BioClinicalBERT + schemas."""
+    return _normalized(extract_with_text(raw_text, tokens))
+
+def extract_ml(tokens, raw_text):
+    """Hybrid output refined by the token classifier in data/model.joblib."""
+    return _normalized(run_model_inference(tokens, copy.deepcopy(extract_hybrid(tokens, raw_text))))
+
+def extract_template(tokens, raw_text):
+    """Production path: layout template fast path, hybrid on a miss."""
+    # Evaluation may run inside the API process; keep it out of /templates/stats
+    return extract_from_template(tokens, count=False) or extract_hybrid(tokens, raw_text)
+
+EXTRACTORS = {
+    "regex": extract_regex,
+    "hybrid": extract_hybrid,
+    "ml": extract_ml,
+    "template": extract_template,
+}
 
-        # -----------------------------------
-        # Step 1: Run OCR on PNG
-        # -----------------------------------
-        img_file = exp_file.replace("_expected.json", ".png")
+def evaluate_sample(exp_file, variants):
+    """Score every variant on one sample. Runs inside a pool worker."""
+    expected = safe_load(exp_file)
+    if not expected:
+        return {"status": "missing"}
+
+    img_file = exp_file.replace("_expected.json", ".png")
+    try:
+        tokens, raw_text = sample_ocr(img_file)
+    except Exception as e:
+        return {"status": "ocr_failed", "error": str(e)}
+
+    result = {"status": "ok"}
+    for name in variants:
+        start = time.perf_counter()
         try:
-            tokens, raw_text = ocr_image(img_file)
+            got = EXTRACTORS[name](tokens, raw_text)
         except Exception as e:
-            summary[base] = {"status": "ocr_failed", "error": str(e)}
+            result[name] = {"status": "failed", "error": str(e)}
             continue
+        latency_ms = (time.perf_counter() - start) * 1000
 
-        # -----------------------------------
-        # Step 2: Regex-only extractor
-        # -----------------------------------
-        regex_patient = parse_patient_info(raw_text)
-        regex_tests = parse_tests(raw_text)
+        patient_results = compare_dicts(expected.get("patient", {}), got.get("patient", {}))
+        test_results, test_score = compare_tests(expected.get("tests", []), got.get("tests", []))
+        patient_score = sum(patient_results.values()) / max(1, len(patient_results))
+        result[name] = {
+            "patient_accuracy": round(patient_score * 100, 2),
+            "test_accuracy": round(test_score * 100, 2),
+            "latency_ms": round(latency_ms, 2),
+            "patient_results": patient_results,
+            "test_results": test_results
+        }
+    return result
 
-        patient_results_regex = compare_dicts(expected.get("patient", {}), regex_patient)
-        test_results_regex, test_score_regex = compare_tests(expected.get("tests", []), regex_tests)
-        regex_patient_score = sum(patient_results_regex.values()) / max(1, len(patient_results_regex))
+def _percentile(values, q):
+    s = sorted(values)
+    return s[min(len(s) - 1, int(round(q * (len(s) - 1))))]
 
-        # -----------------------------------
-        # Step 3: Hybrid extractor (regex + BioClinicalBERT + schemas)
-        # -----------------------------------
-        got = extract_with_text(raw_text)
-        try:
-            got = Report(**got).dict()  # normalize via schema
-        except Exception:
-            pass
-
-        patient_results_hybrid = compare_dicts(expected.get("patient", {}), got.get("patient", {}))
-        test_results_hybrid, test_score_hybrid = compare_tests(expected.get("tests", []), got.get("tests", []))
-        hybrid_patient_score = sum(patient_results_hybrid.values()) / max(1, len(patient_results_hybrid))
-
-        # -----------------------------------
-        # Collect results
-        # -----------------------------------
-        summary[base] = {
-            "regex": {
-                "patient_accuracy": round(regex_patient_score * 100, 2),
-                "test_accuracy": round(test_score_regex * 100, 2),
-                "patient_results": patient_results_regex,
-                "test_results": test_results_regex
-            },
-            "hybrid": {
-                "patient_accuracy": round(hybrid_patient_score * 100, 2),
-                "test_accuracy": round(test_score_hybrid * 100, 2),
-                "patient_results": patient_results_hybrid,
-                "test_results": test_results_hybrid
-            }
+def summarize(samples, variants):
+    """Side-by-side accuracy and latency per variant across scored samples."""
+    summary = {}
+    for name in variants:
+        scored = [r[name] for r in samples.values() if "latency_ms" in r.get(name, {})]
+        if not scored:
+            summary[name] = {"samples": 0}
+            continue
+        latencies = [r["latency_ms"] for r in scored]
+        summary[name] = {
+            "samples": len(scored),
+            "patient_accuracy": round(sum(r["patient_accuracy"] for r in scored) / len(scored), 2),
+            "test_accuracy": round(sum(r["test_accuracy"] for r in scored) / len(scored), 2),
+            "latency_ms_mean": round(sum(latencies) / len(latencies), 2),
+            "latency_ms_p95": round(_percentile(latencies, 0.95), 2),
         }
-
     return summary
+
+def evaluate_all(variants=None, workers=None):
+    variants = list(variants or EXTRACTORS)
+    unknown = [v for v in variants if v not in EXTRACTORS]
+    if unknown:
+        raise ValueError(f"Unknown extractor variants: {unknown}")
+
+    expected_files = sorted(glob(os.path.join(EXPECTED_DIR, "*_expected.json")))
+    bases = [os.path.basename(f).replace("_expected.json", "") for f in expected_files]
+    # Each worker loads its own models; never run more than there are cores or samples
+    workers = max(1, min(workers or len(expected_files), len(expected_files), os.cpu_count() or 1))
+
+    if workers == 1:
+        results = [evaluate_sample(f, variants) for f in expected_files]
+    else:
+        ctx = mp.get_context("spawn")  # torch does not survive fork reliably
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=init_worker) as pool:
+            results = list(pool.map(evaluate_sample, expected_files, [variants] * len(expected_files)))
+
+    samples = dict(zip(bases, results))
+    return {"variants": summarize(samples, variants), "samples": samples}
+
+# -----------------------------------
+# Background jobs
+# -----------------------------------
+_jobs_lock = threading.Lock()
+_current_job = None
+
+def _job_path(job_id):
+    return os.path.join(EVAL_DIR, f"{job_id}.json")
+
+def _save_job(job):
+    tmp_path = _job_path(job["id"]) + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(job, f, indent=2)
+    os.replace(tmp_path, _job_path(job["id"]))
+
+def _run_job(job, variants, workers):
+    start = time.perf_counter()
+    try:
+        job["result"] = evaluate_all(variants, workers)
+        job["status"] = "done"
+    except Exception as e:
+        job["status"] = "failed"
+        job["error"] = str(e)
+    job["seconds"] = round(time.perf_counter() - start, 2)
+    job["finished"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    _save_job(job)
+
+def start_job(variants=None, workers=None):
+    """Run evaluate_all in a background thread; results are stored in data/eval_results/."""
+    global _current_job
+    unknown = [v for v in (variants or []) if v not in EXTRACTORS]
+    if unknown:
+        raise ValueError(f"Unknown extractor variants: {unknown}")
+    with _jobs_lock:
+        if _current_job and _current_job["status"] == "running":
+            return _current_job
+        job = {
+            "id": time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6],
+            "status": "running",
+            "variants": list(variants or EXTRACTORS),
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        _save_job(job)
+        _current_job = job
+    threading.Thread(target=_run_job, args=(job, variants, workers), daemon=True).start()
+    return job
+
+def mark_interrupted():
+    """Jobs still "running" on startup died with the previous process; mark them so."""
+    for fname in os.listdir(EVAL_DIR):
+        if not fname.endswith(".json"):
+            continue
+        job = safe_load(os.path.join(EVAL_DIR, fname))
+        if job.get("status") == "running":
+            job["status"] = "interrupted"
+            _save_job(job)
+
+def load_job(job_id):
+    path = _job_path(os.path.basename(job_id))
+    return safe_load(path) if os.path.exists(path) else None
+
+def latest_job():
+    """Most recently started job (ids sort by start time)."""
+    ids = sorted(f[:-5] for f in os.listdir(EVAL_DIR) if f.endswith(".json"))
+    return load_job(ids[-1]) if ids else None
+
+if __name__ == "__main__":
+    print(json.dumps(evaluate_all()["variants"], indent=2))
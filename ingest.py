@@ -0,0 +1,196 @@
+import os, sys, json, time, argparse
+import multiprocessing as mp
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from src.dedup import file_sha256
+from src.workers import init_worker
+
+CHECKPOINT_PATH = "data/ingest_manifest.json"
+WORK_DIR = "data/ingest"
+EXTENSIONS = {".pdf", ".png", ".jpg", ".jpeg", ".tif", ".tiff"}
+
+
+def list_sources(source):
+    """Files under a directory, or the paths listed one per line in a manifest file."""
+    if os.path.isdir(source):
+        paths = []
+        for root, _, files in os.walk(source):
+            for fname in files:
+                if os.path.splitext(fname)[1].lower() in EXTENSIONS:
+                    paths.append(os.path.join(root, fname))
+        return sorted(paths)
+    with open(source, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def report_name(path, source):
+    """
+    Report id for a file: its path relative to the source, flattened, with the
+    extension kept so scan.pdf and scan.png stay apart.
+    Prefixed with "ingest__" so it can never collide with an upload's id.
+    """
+    root = source if os.path.isdir(source) else os.path.dirname(os.path.abspath(source))
+    rel = os.path.relpath(os.path.abspath(path), os.path.abspath(root))
+    return "ingest__" + rel.replace(os.sep, "__").replace(".", "_")
+
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return {"files": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_checkpoint(path, manifest):
+    """Write the manifest atomically so a crash never leaves it half-written."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def ingest_file(path, report, digest):
+    """Preprocess -> OCR -> extract -> store one file. Runs inside a pool worker."""
+    # Imported here so only workers load the OCR/NER models
+    from src.preprocessing import preprocess_input
+    from src.ocr import ocr_image
+    from src.extract_rules import extract_with_text
+    from src.templates import extract_from_template
+    from src.dedup import load_cached_ocr, save_cached_ocr, perceptual_hash
+    from src.storage import save_confirmed, save_pages
+    from src.artifacts import flush
+
+    start = time.perf_counter()
+    pages = preprocess_input(path, os.path.join(WORK_DIR, digest[:16]))
+
+    all_tokens, texts, measured = [], [], []
+    for page_path in pages:
+        page_digest = file_sha256(page_path)
+        cached = load_cached_ocr(page_digest)
+        if cached:
+            tokens, text = cached["tokens"], cached["text"]
+        else:
+            ocr_stats = {}
+            tokens, text = ocr_image(page_path, ocr_stats)
+            if "seconds_saved" in ocr_stats:
+                measured.append(ocr_stats["seconds_saved"])
+            save_cached_ocr(page_digest, page_path, perceptual_hash(page_path), tokens, text)
+        all_tokens.append(tokens)
+        texts.append(text)
+
+    parsed = extract_from_template(all_tokens[0]) if len(pages) == 1 else None
+    if parsed is None:
+        parsed = extract_with_text("\n\n".join(t for t in texts if t), [t for page in all_tokens for t in page])
+
+    save_confirmed(f"{report}.json", parsed)
+    save_pages(f"{report}.json", pages)
+    flush()  # pool workers exit without running atexit hooks
+    return {"pages": len(pages), "seconds": round(time.perf_counter() - start, 3),
+            "ocr_seconds_saved": measured}
+
+
+def run(source, workers, checkpoint, retry_errors=False):
+    manifest = load_checkpoint(checkpoint)
+    entries = manifest.setdefault("files", {})
+
+    # Decide what needs work: unchanged files that finished before are skipped
+    todo, skipped = [], 0
+    owners = {e["report"]: k for k, e in entries.items() if e.get("report") and os.path.exists(k)}
+    for path in list_sources(source):
+        key = os.path.abspath(path)
+        try:
+            st = os.stat(path)
+        except OSError as e:
+            entries[key] = {"status": "error", "error": str(e)}
+            continue
+        entry = entries.get(key, {})
+        if entry.get("status") == "done" and entry.get("size") == st.st_size and entry.get("mtime") == st.st_mtime_ns:
+            skipped += 1
+            continue
+        digest = file_sha256(path)
+        if entry.get("sha256") == digest and (entry.get("status") == "done" or not retry_errors and entry.get("status") == "error"):
+            entry.update({"size": st.st_size, "mtime": st.st_mtime_ns})
+            skipped += 1
+            continue
+        report = report_name(path, source)
+        if owners.setdefault(report, key) != key:
+            # Never let two files write the same report
+            entries[key] = {"status": "error", "error": f"report id {report} already used by {owners[report]}"}
+            continue
+        entries[key] = {"status": "pending", "size": st.st_size, "mtime": st.st_mtime_ns, "sha256": digest,
+                        "report": report}
+        todo.append(key)
+    save_checkpoint(checkpoint, manifest)
+
+    print(f"Ingesting {len(todo)} files with {workers} workers ({skipped} unchanged, skipped)")
+    start = time.perf_counter()
+    done, pages, saved, errors = 0, 0, [], Counter()
+    crashed = False
+
+    ctx = mp.get_context("spawn")  # torch does not survive fork reliably
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=init_worker) as pool:
+        futures = {pool.submit(ingest_file, key, entries[key]["report"], entries[key]["sha256"]): key for key in todo}
+        try:
+            for fut in as_completed(futures):
+                key = futures[fut]
+                try:
+                    result = fut.result()
+                    entries[key].update(status="done", error=None, **result)
+                    done += 1
+                    pages += result["pages"]
+                    saved.extend(result.pop("ocr_seconds_saved", []))
+                except BrokenProcessPool:
+                    # A worker died (OOM, segfault): not this file's fault, so everything
+                    # unfinished stays pending and the next run retries it
+                    crashed = True
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    break
+                except Exception as e:
+                    entries[key].update(status="error", error=f"{type(e).__name__}: {e}")
+                    errors[type(e).__name__] += 1
+                save_checkpoint(checkpoint, manifest)
+                print(f"[{done + sum(errors.values())}/{len(todo)}] {entries[key]['status']}: {key}")
+        except KeyboardInterrupt:
+            pool.shutdown(wait=False, cancel_futures=True)
+            save_checkpoint(checkpoint, manifest)
+            print("Interrupted; progress saved, rerun to resume")
+            raise
+
+    save_checkpoint(checkpoint, manifest)
+    if crashed:
+        left = sum(1 for k in todo if entries[k]["status"] == "pending")
+        print(f"A worker process died; {left} files left pending, rerun to resume")
+
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    print(f"\nDone: {done} files, {pages} pages in {elapsed:.1f}s "
+          f"({done / elapsed:.2f} files/s, {pages / elapsed:.2f} pages/s)")
+    if saved:
+        print(f"OCR time saved by text-region cropping: {sum(saved) / len(saved):.2f}s/page "
+              f"(measured on {len(saved)} sampled pages)")
+    print(f"Skipped: {skipped}  Failed: {sum(errors.values())}")
+    for name, count in errors.most_common():
+        print(f"  {name}: {count}")
+    failed = [k for k in todo if entries[k]["status"] == "error"]
+    for key in failed[:10]:
+        print(f"  - {key}: {entries[key]['error']}")
+    if len(failed) > 10:
+        print(f"  ... {len(failed) - 10} more in {checkpoint}")
+    return 0 if not failed and not crashed else 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk-ingest lab reports (PDF/images) into data/final_reports/")
+    parser.add_argument("source", help="directory to walk, or a file listing one path per line")
+    parser.add_argument("-w", "--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="worker processes (each loads its own OCR model)")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH, help="progress manifest used to resume")
+    parser.add_argument("--retry-errors", action="store_true", help="retry files that failed in a previous run")
+    args = parser.parse_args(argv)
+    return run(args.source, args.workers, args.checkpoint, args.retry_errors)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,6 @@
 import os, json
 from src.model_training import train_model
+from src.templates import learn_from_corrections
 
 CORRECT_DIR = "data/corrections"
 TRAIN_DIR = "data/training_data"
@@ -25,3 +26,4 @@ def corrections_to_training():
 if __name__ == "__main__":
     corrections_to_training()
     train_model()
+    print(f"Learned {learn_from_corrections()} layout templates")
@@ -0,0 +1,159 @@
+import os, json, hashlib, threading
+import cv2
+
+CACHE_DIR = "data/debug/annotations"
+os.makedirs(CACHE_DIR, exist_ok=True)
+# Rendered annotations are evicted least-recently-used beyond this size
+CACHE_MAX_BYTES = int(os.environ.get("ANNOTATION_CACHE_MB", "512")) * (1 << 20)
+
+FORMATS = {
+    "png": (".png", "image/png", []),
+    "webp": (".webp", "image/webp", [cv2.IMWRITE_WEBP_QUALITY, 80]),
+    "jpeg": (".jpg", "image/jpeg", [cv2.IMWRITE_JPEG_QUALITY, 85]),
+}
+TILE_SIZE = 1024
+
+# (path, mtime, size) -> sha1 of file bytes, so repeat requests skip re-hashing
+_hash_cache = {}
+_cache_bytes = None  # running size of CACHE_DIR, scanned on first write
+_cache_lock = threading.Lock()
+
+
+def image_hash(image_path):
+    """SHA1 of the image bytes, memoized on path + mtime + size."""
+    st = os.stat(image_path)
+    key = (image_path, st.st_mtime_ns, st.st_size)
+    digest = _hash_cache.get(key)
+    if digest is None:
+        h = hashlib.sha1()
+        with open(image_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        _hash_cache[key] = digest
+    return digest
+
+
+def highlight_set(parsed):
+    """Lowercased token texts to highlight: patient values + matched test tokens."""
+    highlights = set()
+    for v in (parsed.get("patient") or {}).values():
+        if v and v != "UNKNOWN":
+            highlights.add(str(v).lower())
+    for t in parsed.get("tests", []):
+        for tok in t.get("matched_tokens", []):
+            highlights.add(str(tok).lower())
+    return highlights
+
+
+def bbox_overlay(tokens, parsed):
+    """Normalized boxes of highlighted tokens, for client-side drawing."""
+    highlights = highlight_set(parsed)
+    return [
+        {"text": t["text"], "bbox": list(t["bbox"])}
+        for t in tokens
+        if t["text"].lower() in highlights
+    ]
+
+
+def tile_grid(width, height, max_side=None):
+    """Rendered size and tile grid for an image of the given dimensions."""
+    scale = _scale(width, height, max_side)
+    w, h = max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+    return {
+        "width": w,
+        "height": h,
+        "tile_size": TILE_SIZE,
+        "rows": (h + TILE_SIZE - 1) // TILE_SIZE,
+        "cols": (w + TILE_SIZE - 1) // TILE_SIZE,
+    }
+
+
+def _scale(width, height, max_side):
+    if max_side is not None and max_side <= 0:
+        raise ValueError(f"max_side must be positive, got {max_side}")
+    if not max_side or max(width, height) <= max_side:
+        return 1.0
+    return max_side / float(max(width, height))
+
+
+def cache_key(digest, boxes, fmt, max_side=None, tile=None):
+    """boxes: the bboxes actually drawn, so re-OCRed tokens invalidate the render."""
+    h = hashlib.sha1()
+    h.update(digest.encode())
+    h.update(json.dumps(sorted(boxes)).encode())
+    h.update(f"|{fmt}|{max_side or 0}|{tile or ''}".encode())
+    return h.hexdigest()
+
+
+def render_annotation(image_path, tokens, parsed, fmt="png", max_side=None, tile=None):
+    """
+    Render highlighted boxes on demand and cache the encoded result.
+    Returns (path, media_type). Cache key = image hash + highlighted boxes
+    + render options, so unchanged pages are never redrawn.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported format: {fmt}")
+    ext, media_type, params = FORMATS[fmt]
+
+    highlights = highlight_set(parsed)
+    boxes = [list(t["bbox"]) for t in tokens if t["text"].lower() in highlights]
+    key = cache_key(image_hash(image_path), boxes, fmt, max_side, tile)
+    out_path = os.path.join(CACHE_DIR, f"{key}{ext}")
+    if os.path.exists(out_path):
+        os.utime(out_path)  # mark as recently used for eviction
+        return out_path, media_type
+
+    img = cv2.imread(image_path)
+    if img is None:
+        raise RuntimeError(f"Failed to load image: {image_path}")
+
+    h, w = img.shape[:2]
+    scale = _scale(w, h, max_side)
+    if scale < 1.0:
+        img = cv2.resize(img, (max(1, int(round(w * scale))), max(1, int(round(h * scale)))), interpolation=cv2.INTER_AREA)
+        h, w = img.shape[:2]
+
+    for x0, y0, x1, y1 in boxes:
+        x0, y0, x1, y1 = int(x0 * w), int(y0 * h), int(x1 * w), int(y1 * h)
+        cv2.rectangle(img, (x0, y0), (x1, y1), (0, 255, 0), 2)
+
+    if tile is not None:
+        row, col = tile
+        y, x = row * TILE_SIZE, col * TILE_SIZE
+        if row < 0 or col < 0 or y >= h or x >= w:
+            raise ValueError(f"Tile out of range: {row},{col}")
+        img = img[y:y + TILE_SIZE, x:x + TILE_SIZE]
+
+    ok, buf = cv2.imencode(ext, img, params)
+    if not ok:
+        raise RuntimeError(f"Failed to encode annotation as {fmt}")
+    with open(out_path, "wb") as f:
+        f.write(buf.tobytes())
+    _account(len(buf))
+    return out_path, media_type
+
+
+def _account(size):
+    """Add a new render to the cache size and evict the oldest renders past the limit."""
+    global _cache_bytes
+    with _cache_lock:
+        if _cache_bytes is None:
+            _cache_bytes = sum(e.stat().st_size for e in os.scandir(CACHE_DIR) if e.is_file())
+        else:
+            _cache_bytes += size
+        if _cache_bytes <= CACHE_MAX_BYTES:
+            return
+        entries = sorted((e for e in os.scandir(CACHE_DIR) if e.is_file()), key=lambda e: e.stat().st_mtime)
+        total = sum(e.stat().st_size for e in entries)
+        # Evict down to 90% so the directory is not rescanned on every write
+        for e in entries:
+            if total <= CACHE_MAX_BYTES * 0.9:
+                break
+            try:
+                size = e.stat().st_size
+                os.remove(e.path)
+                total -= size
+            except OSError:
+                pass
+        _cache_bytes = total
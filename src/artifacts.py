@@ -0,0 +1,140 @@
+import os, copy, json, gzip, queue, atexit, logging, tempfile, threading
+
+logger = logging.getLogger(__name__)
+
+# ARTIFACT_FORMAT: "json" (minified), "json.gz" (minified + gzip) or "pretty" (indent=2)
+ARTIFACT_FORMAT = os.environ.get("ARTIFACT_FORMAT", "json")
+# DEBUG_ARTIFACTS=0 disables token/text debug dumps (production)
+DEBUG_ARTIFACTS = os.environ.get("DEBUG_ARTIFACTS", "1") != "0"
+QUEUE_SIZE = int(os.environ.get("ARTIFACT_QUEUE_SIZE", "256"))
+FORMATS = ("json", "json.gz", "pretty")
+
+if ARTIFACT_FORMAT not in FORMATS:
+    raise ValueError(f"ARTIFACT_FORMAT must be one of {FORMATS}, got {ARTIFACT_FORMAT!r}")
+
+STATS = {"written": 0, "failed": 0, "last_error": None}
+
+_queue = queue.Queue(maxsize=QUEUE_SIZE)
+_pending = {}  # path -> payload queued but not yet on disk, served to readers
+_pending_lock = threading.Lock()
+_failed = {}   # path -> error of its latest write, until a later write succeeds
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def _encode(payload):
+    kind, data, fmt = payload
+    if kind == "text":
+        return data.encode("utf-8")
+    if fmt == "pretty":
+        raw = json.dumps(data, indent=2)
+    else:
+        raw = json.dumps(data, separators=(",", ":"))
+    raw = raw.encode("utf-8")
+    return gzip.compress(raw) if fmt == "json.gz" else raw
+
+
+def _atomic_write(path, raw):
+    """Write to a temp file in the same directory, then rename over the target."""
+    out_dir = os.path.dirname(path) or "."
+    os.makedirs(out_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=out_dir, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(raw)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _run():
+    while True:
+        path, payload = _queue.get()
+        try:
+            _atomic_write(path, _encode(payload))
+            STATS["written"] += 1
+            _failed.pop(path, None)
+        except Exception as e:
+            logger.exception("Artifact write failed: %s", path)
+            STATS["failed"] += 1
+            STATS["last_error"] = f"{path}: {e}"
+            _failed[path] = str(e)
+        finally:
+            with _pending_lock:
+                if _pending.get(path) is payload:
+                    del _pending[path]
+            _queue.task_done()
+
+
+def _submit(path, payload):
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = threading.Thread(target=_run, name="artifact-writer", daemon=True)
+            _writer.start()
+    with _pending_lock:
+        _pending[path] = payload
+    _queue.put((path, payload))  # blocks when the queue is full (backpressure)
+    return path
+
+
+def artifact_path(path, fmt=None):
+    """Final on-disk path for a JSON artifact in the given format."""
+    return f"{path}.gz" if (fmt or ARTIFACT_FORMAT) == "json.gz" else path
+
+
+def write_json(path, data, fmt=None):
+    """Queue a JSON artifact for a background atomic write. Returns the final path."""
+    fmt = fmt or ARTIFACT_FORMAT
+    return _submit(artifact_path(path, fmt), ("json", data, fmt))
+
+
+def write_text(path, text):
+    return _submit(path, ("text", text, None))
+
+
+def write_debug_json(path, data):
+    """Like write_json, but skipped entirely when DEBUG_ARTIFACTS is off."""
+    return write_json(path, data) if DEBUG_ARTIFACTS else None
+
+
+def write_debug_text(path, text):
+    return write_text(path, text) if DEBUG_ARTIFACTS else None
+
+
+def read_json(path):
+    """Read a JSON artifact written in any format, including writes still queued."""
+    candidates = (path, f"{path}.gz")
+    with _pending_lock:
+        for candidate in candidates:
+            if candidate in _pending:
+                return copy.deepcopy(_pending[candidate][1])
+    on_disk = [c for c in candidates if os.path.exists(c)]
+    if not on_disk:
+        return None
+    # Newest wins if the format was switched between runs
+    newest = max(on_disk, key=os.path.getmtime)
+    if newest.endswith(".gz"):
+        with gzip.open(newest, "rt", encoding="utf-8") as f:
+            return json.load(f)
+    with open(newest, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def flush():
+    """Block until every queued artifact is on disk."""
+    _queue.join()
+
+
+def write_error(path, fmt=None):
+    """Error of the latest write to path if it failed, else None. flush() first."""
+    return _failed.get(artifact_path(path, fmt))
+
+
+def artifact_stats():
+    return dict(STATS, queued=_queue.qsize())
+
+
+atexit.register(flush)
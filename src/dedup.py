@@ -0,0 +1,151 @@
+import os, hashlib, tempfile
+import cv2
+import numpy as np
+from src.storage import load_tokens
+from src.artifacts import write_json, read_json
+
+CACHE_DIR = "data/ocr_cache"
+os.makedirs(CACHE_DIR, exist_ok=True)
+
+CHUNK_SIZE = 1 << 20
+PHASH_THRESHOLD = 6  # max differing bits (of 64) for two pages to be duplicate candidates
+CONFIRM_SIZE = 128   # binarized thumbnail used to confirm a candidate
+CONFIRM_THRESHOLD = 0.015  # max fraction of differing ink pixels for the same page
+
+
+def save_upload(fileobj, dest_dir, filename):
+    """
+    Stream an upload to dest_dir while hashing it.
+    Returns (path, sha256). Files are stored under a content-addressed name
+    ("<sha256[:16]>_<filename>") so a later upload with the same name can never
+    overwrite them; bytes already seen reuse the earlier copy.
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    h = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=dest_dir, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b""):
+                h.update(chunk)
+                out.write(chunk)
+        digest = h.hexdigest()
+        prefix = f"{digest[:16]}_"
+
+        # Only content-addressed copies are trusted to still hold these bytes
+        cached = load_cached_ocr(digest)
+        if cached and os.path.basename(cached["path"]).startswith(prefix) and os.path.exists(cached["path"]):
+            os.remove(tmp_path)
+            return cached["path"], digest
+
+        path = os.path.join(dest_dir, prefix + os.path.basename(filename))
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, path)
+        return path, digest
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# (path, mtime, size) -> sha256 of file bytes, so repeat token lookups skip re-hashing
+_sha_cache = {}
+
+
+def cached_sha256(path):
+    """file_sha256 memoized on path + mtime + size."""
+    st = os.stat(path)
+    key = (path, st.st_mtime_ns, st.st_size)
+    digest = _sha_cache.get(key)
+    if digest is None:
+        digest = file_sha256(path)
+        _sha_cache[key] = digest
+    return digest
+
+
+def perceptual_hash(image_path):
+    """64-bit difference hash of the decoded page, or None if it cannot be decoded."""
+    img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        return None
+    small = cv2.resize(img, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    value = 0
+    for b in bits:
+        value = (value << 1) | int(b)
+    return value
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def page_thumbnail(image_path):
+    """Otsu-binarized CONFIRM_SIZE² thumbnail (True = ink), or None if undecodable."""
+    img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        return None
+    small = cv2.resize(img, (CONFIRM_SIZE, CONFIRM_SIZE), interpolation=cv2.INTER_AREA)
+    return cv2.threshold(small, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[1] > 0
+
+
+def ink_difference(a, b):
+    """Differing ink pixels relative to all ink pixels of two thumbnails."""
+    union = np.logical_or(a, b).sum()
+    return np.logical_xor(a, b).sum() / float(max(1, union))
+
+
+def find_near_duplicate(phash, pages, image_path):
+    """
+    Return the first page that is the same page as image_path, else None.
+    A dHash within PHASH_THRESHOLD only makes a page a candidate: 9x8 hashes of
+    pages sharing one lab template are close, so candidates are confirmed by
+    comparing binarized thumbnails before OCR is skipped.
+    """
+    if phash is None:
+        return None
+    thumb = None
+    for page in pages:
+        if page.get("phash") is None or hamming(phash, page["phash"]) > PHASH_THRESHOLD:
+            continue
+        if thumb is None:
+            thumb = page_thumbnail(image_path)
+            if thumb is None:
+                return None
+        if page.get("thumb") is None:
+            page["thumb"] = page_thumbnail(page["path"])
+        if page["thumb"] is not None and ink_difference(thumb, page["thumb"]) <= CONFIRM_THRESHOLD:
+            return page
+    return None
+
+
+def load_cached_ocr(digest):
+    """Previous OCR result for these exact bytes, if any."""
+    return read_json(os.path.join(CACHE_DIR, f"{digest}.json"))
+
+
+def save_cached_ocr(digest, image_path, phash, tokens, full_text):
+    return write_json(os.path.join(CACHE_DIR, f"{digest}.json"), {
+        "path": image_path,
+        "phash": phash,
+        "tokens": tokens,
+        "text": full_text,
+    })
+
+
+def page_tokens(image_path):
+    """OCR tokens for a page image: from the content-hash cache, else the tokens dir."""
+    if os.path.exists(image_path):
+        cached = load_cached_ocr(cached_sha256(image_path))
+        if cached:
+            return cached["tokens"]
+    return load_tokens(image_path)
@@ -2,6 +2,7 @@ import re
 from typing import Dict, Any, List
 from transformers import AutoTokenizer, AutoModelForTokenClassification, pipeline
 from src.schemas import Report, Patient, TestResult
+from src.vocab import normalize_tests
 import warnings
 import logging
 import transformers
@@ -168,11 +169,11 @@ def extract_with_text(text: str, tokens: List[Dict[str, Any]] = None) -> Dict[st
     cleaned = clean_text_for_parsing(text)
 
     patient, patient_confs = parse_patient_info(cleaned, tokens)
-    tests = parse_tests(cleaned, tokens)
+    tests = normalize_tests(parse_tests(cleaned, tokens))
 
     report = Report(
         patient=Patient(**patient),
-        tests=[TestResult(**{k: v for k, v in t.items() if k in ["name", "value", "unit", "matched_tokens"]}) for t in tests]
+        tests=[TestResult(**{k: v for k, v in t.items() if k in ["name", "raw_name", "value", "unit", "matched_tokens", "canonical_id", "match_distance"]}) for t in tests]
     )
 
     output = report.dict()
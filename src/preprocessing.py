@@ -15,25 +15,96 @@ def deskew(image):
     M = cv2.getRotationMatrix2D((w//2, h//2), angle, 1.0)
     return cv2.warpAffine(image, M, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
 
-def preprocess_image(path):
+# Text-region detection thresholds (fractions of page size / ink density)
+MAX_LINE_HEIGHT = 0.04   # taller blobs touching the page edge may be scanner borders
+MAX_INK = 0.45           # ...and are dropped only when solid, unlike text blocks
+MIN_SPECK = 0.004        # blobs smaller than this in both dimensions are noise
+REGION_PAD = 0.01
+MIN_SAVING = 0.05        # skip cropping unless at least this much area is removed
+# Ink = darker than the local mean by ADAPTIVE_C, so light-grey print (footers,
+# watermark-style headers) counts as text where a global Otsu cutoff drops it
+ADAPTIVE_BLOCK = 0.02    # neighbourhood size as a fraction of page width
+ADAPTIVE_C = 10
+
+def find_text_regions(image):
+    """
+    Bounding boxes (x, y, w, h) of text, found by merging characters with a
+    small horizontal closing and filtering connected components. Specks and
+    solid bars along the page edge are dropped; anything that may hold text
+    (including reverse-video headers) is kept.
+    Ink comes from an adaptive threshold: the inside of a solid block equals its
+    local mean, so reverse-video text leaves an outline plus letter edges
+    rather than a solid blob.
+    """
+    gray = image if len(image.shape)==2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    H, W = gray.shape[:2]
+    block = max(15, int(ADAPTIVE_BLOCK * W)) | 1
+    ink = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, block, ADAPTIVE_C)
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(3, W // 150), max(1, H // 800)))
+    merged = cv2.morphologyEx(ink, cv2.MORPH_CLOSE, kernel)
+
+    n, _, stats, _ = cv2.connectedComponentsWithStats(merged, connectivity=8)
+    regions = []
+    for i in range(1, n):
+        x, y, w, h, _ = stats[i]
+        if w < MIN_SPECK * W and h < MIN_SPECK * H:
+            continue
+        on_edge = x == 0 or y == 0 or x + w == W or y + h == H
+        if on_edge and h > MAX_LINE_HEIGHT * H:
+            density = cv2.countNonZero(ink[y:y + h, x:x + w]) / float(w * h)
+            if density > MAX_INK:
+                continue
+        regions.append((int(x), int(y), int(w), int(h)))
+    return regions
+
+def crop_to_text(image):
+    """
+    Crop to the union of the text regions. Nothing inside the crop is blanked:
+    a region the detector missed (faint or reverse-video print) stays visible to
+    OCR as long as it lies between regions that were found.
+    Returns (cropped, (x, y, w, h) of the crop in page pixels, fraction of the
+    page left visible to OCR).
+    The image is returned unchanged when cropping would not remove enough.
+    """
+    H, W = image.shape[:2]
+    regions = find_text_regions(image)
+    if not regions:
+        return image, (0, 0, W, H), 1.0
+
+    px, py = int(REGION_PAD * W), int(REGION_PAD * H)
+    x0 = max(0, min(x for x, _, _, _ in regions) - px)
+    y0 = max(0, min(y for _, y, _, _ in regions) - py)
+    x1 = min(W, max(x + w for x, _, w, _ in regions) + px)
+    y1 = min(H, max(y + h for _, y, _, h in regions) + py)
+
+    kept_fraction = (x1 - x0) * (y1 - y0) / float(W * H)
+    if kept_fraction > 1.0 - MIN_SAVING:
+        return image, (0, 0, W, H), 1.0
+    return image[y0:y1, x0:x1], (x0, y0, x1 - x0, y1 - y0), kept_fraction
+
+def preprocess_image(path, out_dir="."):
     img = cv2.imread(path)
+    if img is None:
+        raise RuntimeError(f"Failed to load image: {path}")
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
     desk = deskew(gray)
     thr = cv2.threshold(desk, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
     den = cv2.medianBlur(thr, 3)
-    out_path = f"cleaned_{os.path.basename(path)}"
+    out_path = os.path.join(out_dir, f"cleaned_{os.path.basename(path)}")
     cv2.imwrite(out_path, den)
     return out_path
 
-def preprocess_input(file_path):
+def preprocess_input(file_path, out_dir="."):
+    """Preprocess an image or every page of a PDF; outputs are written into out_dir."""
+    os.makedirs(out_dir, exist_ok=True)
     ext = os.path.splitext(file_path)[1].lower()
     out_paths = []
     if ext == ".pdf":
         pages = convert_from_path(file_path, dpi=300)
         for i, page in enumerate(pages):
-            ip = f"page_{i+1}.png"
+            ip = os.path.join(out_dir, f"page_{i+1}.png")
             page.save(ip, "PNG")
-            out_paths.append(preprocess_image(ip))
+            out_paths.append(preprocess_image(ip, out_dir))
     else:
-        out_paths.append(preprocess_image(file_path))
+        out_paths.append(preprocess_image(file_path, out_dir))
     return out_paths
@@ -8,6 +8,9 @@ class TestResult(BaseModel):
     unit: Optional[str] = Field(default="", description="Measurement unit")
     matched_tokens: List[str] = []
     confidence: float = Field(default=1.0, description="Confidence score of extraction (0–1)")
+    raw_name: Optional[str] = Field(default=None, description="Test label as printed, before vocabulary normalization")
+    canonical_id: Optional[str] = Field(default=None, description="Lab-test vocabulary id")
+    match_distance: Optional[int] = Field(default=None, description="Edit distance to the matched vocabulary alias")
 
     @validator("unit", pre=True, always=True)
     def normalize_unit(cls, v):
@@ -1,11 +1,15 @@
-import os, json
+import os
+from src.artifacts import write_json, read_json
 
 # Define dedicated save folders
 FINAL_DIR = "data/final_reports"
 CORRECT_DIR = "data/corrections"
+TOKENS_DIR = "data/samples/tokens"
+PAGES_DIR = "data/pages"
 
 os.makedirs(FINAL_DIR, exist_ok=True)
 os.makedirs(CORRECT_DIR, exist_ok=True)
+os.makedirs(PAGES_DIR, exist_ok=True)
 
 def save_confirmed(filename, data):
     """
@@ -13,9 +17,7 @@ def save_confirmed(filename, data):
     """
     base = os.path.splitext(filename)[0]
     out_path = os.path.join(FINAL_DIR, f"{base}.json")
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
-    return out_path
+    return write_json(out_path, data, fmt="pretty")
 
 def save_correction(filename, data):
     """
@@ -23,8 +25,7 @@ def save_correction(filename, data):
     """
     base = os.path.splitext(filename)[0]
     out_path = os.path.join(CORRECT_DIR, f"{base}_corrected.json")
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
+    write_json(out_path, data, fmt="pretty")
     # Keep the final report in sync with the latest correction
     save_confirmed(filename, data)
     return out_path
@@ -34,8 +35,35 @@ def load_correction(filename):
     """Load previously saved corrections for a file if available."""
     base = os.path.splitext(filename)[0]
     in_path = os.path.join(CORRECT_DIR, f"{base}_corrected.json")
-    if not os.path.exists(in_path):
-        return None
+    return read_json(in_path)
+
+
+def load_confirmed(filename):
+    """Load the saved report JSON for a file if available."""
+    base = os.path.splitext(filename)[0]
+    in_path = os.path.join(FINAL_DIR, f"{base}.json")
+    return read_json(in_path)
+
+
+def load_tokens(image_name):
+    """Load the OCR tokens saved by ocr_image for a page image."""
+    in_path = os.path.join(TOKENS_DIR, f"tokens_{os.path.basename(image_name)}.json")
+    return read_json(in_path)
 
-    with open(in_path, "r", encoding="utf-8") as f:
-        return json.load(f)
+
+def save_pages(filename, pages):
+    """Record the page image paths that make up a report into data/pages/."""
+    base = os.path.splitext(filename)[0]
+    out_path = os.path.join(PAGES_DIR, f"{base}.json")
+    return write_json(out_path, pages, fmt="pretty")
+
+
+def load_pages(filename):
+    """Load the page image paths recorded for a report if available."""
+    base = os.path.splitext(filename)[0]
+    pages = read_json(os.path.join(PAGES_DIR, f"{base}.json"))
+    if pages is None:
+        # Records written before data/pages/ existed; a report named "<base>_pages" is not one
+        legacy = read_json(os.path.join(FINAL_DIR, f"{base}_pages.json"))
+        pages = legacy if isinstance(legacy, list) else None
+    return pages
@@ -0,0 +1,360 @@
+import os, json, hashlib
+from typing import Dict, Any, List, Optional
+from src.schemas import Report, Patient, TestResult
+from src.storage import CORRECT_DIR, load_pages
+from src.dedup import page_tokens
+from src.vocab import lookup, normalize_tests
+
+TEMPLATE_DIR = "data/templates"
+os.makedirs(TEMPLATE_DIR, exist_ok=True)
+
+HEADER_FRACTION = 0.25   # top part of the page used for fingerprinting
+GRID = 20                # bbox quantization for the header signature
+MATCH_THRESHOLD = 0.6    # minimum Jaccard similarity of header signatures
+PAD = 0.005              # padding around learned field regions (normalized)
+X_SLACK = 0.05           # extra room to the right for longer values
+
+STATS = {"hits": 0, "misses": 0}
+_templates = None
+
+
+# -----------------------------
+# Fingerprinting
+# -----------------------------
+def header_signature(tokens: List[Dict[str, Any]], exclude=()) -> List[str]:
+    """Header words with their quantized positions, e.g. 'laboratory@7,0'.
+    exclude: token indices to leave out (per-report values such as the patient name)."""
+    sig = set()
+    for i, t in enumerate(tokens):
+        if i in exclude:
+            continue
+        x0, y0 = t["bbox"][0], t["bbox"][1]
+        text = t["text"].lower()
+        if y0 > HEADER_FRACTION or len(text) < 3 or not text.isalpha():
+            continue
+        sig.add(f"{text}@{int(x0 * GRID)},{int(y0 * GRID)}")
+    return sorted(sig)
+
+
+def fingerprint(signature: List[str]) -> str:
+    return hashlib.sha1("|".join(signature).encode()).hexdigest()[:12]
+
+
+def _jaccard(a, b) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _load_templates() -> Dict[str, Dict[str, Any]]:
+    global _templates
+    if _templates is None:
+        _templates = {}
+        for fname in os.listdir(TEMPLATE_DIR):
+            if not fname.endswith(".json"):
+                continue
+            with open(os.path.join(TEMPLATE_DIR, fname), "r", encoding="utf-8") as f:
+                tmpl = json.load(f)
+            tmpl["_sig"] = set(tmpl["signature"])
+            _templates[tmpl["id"]] = tmpl
+    return _templates
+
+
+def match_template(tokens: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Return the stored template whose header best matches these tokens."""
+    sig = set(header_signature(tokens))
+    best, best_score = None, MATCH_THRESHOLD
+    for tmpl in _load_templates().values():
+        score = _jaccard(sig, tmpl["_sig"])
+        if score >= best_score:
+            best, best_score = tmpl, score
+    return best
+
+
+# -----------------------------
+# Learning from corrections
+# -----------------------------
+def _find_region(tokens, value, used):
+    """Union bbox of the tokens spelling out value, or None if not all found."""
+    words = str(value).split()
+    if not words:
+        return None
+    boxes = []
+    for w in words:
+        for i, t in enumerate(tokens):
+            if i not in used and t["text"].lower() == w.lower():
+                used.add(i)
+                boxes.append(t["bbox"])
+                break
+        else:
+            return None
+    return [
+        max(0.0, min(b[0] for b in boxes) - PAD),
+        max(0.0, min(b[1] for b in boxes) - PAD),
+        min(1.0, max(b[2] for b in boxes) + PAD + X_SLACK),
+        min(1.0, max(b[3] for b in boxes) + PAD),
+    ]
+
+
+def _find_label(tokens, value_region, used):
+    """Region and text of the unused tokens left of a value on the same line."""
+    x0, y0, _, y1 = value_region
+    found = []
+    for i, t in enumerate(tokens):
+        bx0, by0, bx1, by1 = t["bbox"]
+        if i not in used and bx1 <= x0 + PAD and y0 <= (by0 + by1) / 2.0 <= y1:
+            found.append(t)
+    if not found:
+        return None, ""
+    found.sort(key=lambda t: t["bbox"][0])
+    region = [
+        max(0.0, min(t["bbox"][0] for t in found) - PAD),
+        max(0.0, min(t["bbox"][1] for t in found) - PAD),
+        min(1.0, max(t["bbox"][2] for t in found) + PAD),
+        min(1.0, max(t["bbox"][3] for t in found) + PAD),
+    ]
+    return region, " ".join(t["text"] for t in found)
+
+
+def _label_text(text: str) -> str:
+    return " ".join(str(text).lower().split())
+
+
+def _label_matches(row, text: str) -> bool:
+    """Whether the label read from the page names the test this row was learned for."""
+    if row.get("canonical_id"):
+        hit = lookup(text)
+        return hit is not None and hit["id"] == row["canonical_id"]
+    return _label_text(text) == row.get("label_text")
+
+
+def _value_tokens(tokens, corrected) -> set:
+    """Indices of tokens spelling any corrected value; these vary per report."""
+    words = set()
+    for value in (corrected.get("patient") or {}).values():
+        if value not in (None, "", "UNKNOWN"):
+            words.update(str(value).lower().split())
+    for row in corrected.get("tests", []):
+        words.update(str(row.get("value") or "").lower().split())
+    return {i for i, t in enumerate(tokens) if t["text"].lower() in words}
+
+
+def _union(a, b):
+    if not a or not b:
+        return a or b
+    return [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+
+
+def _merge(existing: Dict[str, Any], signature, fields, tests) -> Dict[str, Any]:
+    """
+    Fold one more sample into a template. Regions are unioned across samples;
+    signature words and fields are kept once seen in at least half the samples,
+    so a value that happened to land in one header does not stick.
+    """
+    samples = existing.get("samples", 0) + 1
+    # Templates learned before counts were kept: assume every entry was seen each time
+    counts = existing.get("counts") or {
+        "signature": {w: samples - 1 for w in existing.get("signature", [])},
+        "fields": {k: samples - 1 for k in existing.get("fields", {})},
+        "tests": {t["name"]: samples - 1 for t in existing.get("tests", [])},
+    }
+    for w in signature:
+        counts["signature"][w] = counts["signature"].get(w, 0) + 1
+
+    all_fields = dict(existing.get("all_fields") or existing.get("fields", {}))
+    for key, region in fields.items():
+        all_fields[key] = _union(all_fields.get(key), region)
+        counts["fields"][key] = counts["fields"].get(key, 0) + 1
+
+    all_tests = {t["name"]: dict(t) for t in existing.get("all_tests") or existing.get("tests", [])}
+    for row in tests:
+        prev = all_tests.get(row["name"])
+        if prev:
+            row = dict(row, value=_union(prev["value"], row["value"]), unit=_union(prev.get("unit"), row["unit"]),
+                       label=_union(prev.get("label"), row["label"]),
+                       default_unit=row["default_unit"] or prev.get("default_unit", ""))
+        all_tests[row["name"]] = row
+        counts["tests"][row["name"]] = counts["tests"].get(row["name"], 0) + 1
+
+    def kept(kind, key):
+        return counts[kind].get(key, 0) * 2 >= samples
+
+    return {
+        "signature": sorted(w for w in counts["signature"] if kept("signature", w)),
+        "fields": {k: r for k, r in all_fields.items() if kept("fields", k)},
+        "tests": [t for name, t in all_tests.items() if kept("tests", name)],
+        "all_fields": all_fields,
+        "all_tests": list(all_tests.values()),
+        "counts": counts,
+        "samples": samples,
+    }
+
+
+def learn_template(tokens: List[Dict[str, Any]], corrected: Dict[str, Any]) -> Optional[str]:
+    """
+    Learn field positions for this page's layout from a confirmed correction.
+    Samples of a known layout are merged into its template rather than replacing it.
+    Returns the template id, or None if nothing could be located.
+    """
+    used = set()
+    fields = {}
+    for key, value in (corrected.get("patient") or {}).items():
+        if value in (None, "", "UNKNOWN"):
+            continue
+        region = _find_region(tokens, value, used)
+        if region:
+            fields[key] = region
+
+    tests = []
+    for row in corrected.get("tests", []):
+        if not row.get("name") or row.get("value") in (None, ""):
+            continue
+        value_region = _find_region(tokens, row["value"], used)
+        if not value_region:
+            continue
+        # Rows are only reused when their label can be re-read and checked at extraction
+        label_region, label = _find_label(tokens, value_region, used)
+        if not label_region:
+            continue
+        label_hit, name_hit = lookup(label), lookup(row["name"])
+        if name_hit and (not label_hit or label_hit["id"] != name_hit["id"]):
+            continue
+        unit = row.get("unit") or ""
+        tests.append({
+            "name": row["name"],
+            "label": label_region,
+            "canonical_id": name_hit["id"] if name_hit else None,
+            "label_text": _label_text(label),
+            "value": value_region,
+            "unit": _find_region(tokens, unit, used) if unit else None,
+            "default_unit": unit,
+        })
+
+    if not fields and not tests:
+        return None
+
+    # Patient/doctor names and values must not become part of the layout fingerprint
+    signature = header_signature(tokens, exclude=used | _value_tokens(tokens, corrected))
+    if not signature:
+        return None
+
+    existing = match_template(tokens)
+    tmpl = _merge(existing or {}, signature, fields, tests)
+    tmpl["id"] = existing["id"] if existing else fingerprint(signature)
+    with open(os.path.join(TEMPLATE_DIR, f"{tmpl['id']}.json"), "w", encoding="utf-8") as f:
+        json.dump(tmpl, f, indent=2)
+    tmpl["_sig"] = set(tmpl["signature"])
+    _load_templates()[tmpl["id"]] = tmpl
+    return tmpl["id"]
+
+
+def learn_from_corrections() -> int:
+    """Learn templates from every single-page correction in data/corrections/."""
+    learned = 0
+    for fname in os.listdir(CORRECT_DIR):
+        if not fname.endswith("_corrected.json"):
+            continue
+        report = fname.replace("_corrected.json", ".json")
+        pages = load_pages(report) or []
+        if len(pages) != 1:
+            continue
+        tokens = page_tokens(pages[0])
+        if not tokens:
+            continue
+        with open(os.path.join(CORRECT_DIR, fname), "r", encoding="utf-8") as f:
+            corrected = json.load(f)
+        if learn_template(tokens, corrected):
+            learned += 1
+    return learned
+
+
+# -----------------------------
+# Fast positional extraction
+# -----------------------------
+def _tokens_in(tokens, region):
+    x0, y0, x1, y1 = region
+    found = []
+    for t in tokens:
+        bx0, by0, bx1, by1 = t["bbox"]
+        cx, cy = (bx0 + bx1) / 2.0, (by0 + by1) / 2.0
+        if x0 <= cx <= x1 and y0 <= cy <= y1:
+            found.append(t)
+    found.sort(key=lambda t: t["bbox"][0])
+    return found
+
+
+def _mean_conf(found) -> float:
+    return round(sum(t.get("confidence", 0.5) for t in found) / len(found), 3)
+
+
+def extract_from_template(tokens: List[Dict[str, Any]], count: bool = True) -> Optional[Dict[str, Any]]:
+    """
+    Extract values straight from a known layout's token regions.
+    Returns the same shape as extract_with_text, or None on a template miss.
+    count=False keeps the call out of the live hit rate (evaluation runs).
+    """
+    stats = STATS if count else {"hits": 0, "misses": 0}
+    tmpl = match_template(tokens) if tokens else None
+    if tmpl is None:
+        stats["misses"] += 1
+        return None
+
+    patient, patient_confs = {}, {}
+    for key, region in tmpl["fields"].items():
+        found = _tokens_in(tokens, region)
+        if found:
+            patient[key] = " ".join(t["text"] for t in found)
+            patient_confs[key] = _mean_conf(found)
+
+    tests = []
+    for row in tmpl["tests"]:
+        # The name comes from the template, so the page must show the same test there
+        if not row.get("label"):
+            continue
+        label = " ".join(t["text"] for t in _tokens_in(tokens, row["label"]))
+        if not _label_matches(row, label):
+            continue
+        found = _tokens_in(tokens, row["value"])
+        if not found:
+            continue
+        value = " ".join(t["text"] for t in found)
+        unit_found = _tokens_in(tokens, row["unit"]) if row.get("unit") else []
+        unit = " ".join(t["text"] for t in unit_found) or row.get("default_unit", "")
+        matched = found + unit_found
+        tests.append({
+            "name": row["name"],
+            "raw_name": label,
+            "value": value,
+            "unit": unit,
+            "matched_tokens": [t["text"] for t in matched],
+            "confidence": _mean_conf(matched),
+        })
+
+    # Layout drifted, or a different panel on the same letterhead -> take the slow path
+    if tmpl["tests"] and len(tests) * 2 < len(tmpl["tests"]):
+        stats["misses"] += 1
+        return None
+
+    normalize_tests(tests)
+    report = Report(
+        patient=Patient(**{k: v for k, v in patient.items() if k in Patient.__fields__}),
+        tests=[TestResult(**{k: v for k, v in t.items() if k in ["name", "raw_name", "value", "unit", "matched_tokens", "canonical_id", "match_distance"]}) for t in tests]
+    )
+
+    output = report.dict()
+    for i, t in enumerate(tests):
+        output["tests"][i]["confidence"] = t["confidence"]
+    output["patient_confidence"] = patient_confs
+
+    stats["hits"] += 1
+    return output
+
+
+def template_stats() -> Dict[str, Any]:
+    total = STATS["hits"] + STATS["misses"]
+    return {
+        "templates": len(_load_templates()),
+        "hits": STATS["hits"],
+        "misses": STATS["misses"],
+        "hit_rate": round(STATS["hits"] / total, 3) if total else 0.0,
+    }
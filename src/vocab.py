@@ -0,0 +1,192 @@
+import re, json
+from collections import defaultdict
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Tuple
+
+VOCAB_PATH = "data/lab_tests.json"
+
+# Specimen words that do not change which test it is ("Creatinine - Serum")
+STOPWORDS = {"serum", "plasma", "whole", "blood", "level", "levels"}
+MAX_NGRAM = 4       # longest trailing word n-gram tried for noisy labels
+MIN_NGRAM_KEY = 3   # shorter n-grams ("m", "ca") only match as the whole label
+# Words that make a label a different test than its trailing words name:
+# "Non HDL Cholesterol" is not HDL, "Urine Glucose" is not blood glucose
+QUALIFIERS = {
+    "non", "urine", "urinary", "free", "ionized", "ionised", "absolute", "abs", "ratio",
+    "estimated", "mean", "average", "avg", "direct", "indirect", "fasting", "random",
+    "pp", "postprandial", "post", "prandial", "corrected", "calculated", "stool", "csf",
+    "fluid", "spot", "microalbumin", "glycated", "glycosylated", "anti", "antibody",
+}
+
+
+def _key(name: str) -> str:
+    """Normalize a test name for lookup: lowercase, punctuation and specimen words dropped."""
+    words = re.sub(r"[^a-z0-9%]+", " ", str(name).lower()).split()
+    return " ".join(w for w in words if w not in STOPWORDS)
+
+
+def _strip_parentheticals(name: str) -> str:
+    return re.sub(r"\(.*?\)|\[.*?\]", " ", str(name))
+
+
+def _strip_leading_numbers(key: str) -> str:
+    """Drop leading tokens without letters, e.g. the reference range in '40 54 mcv'."""
+    words = key.split()
+    while words and not re.search(r"[a-z]", words[0]):
+        words.pop(0)
+    return " ".join(words)
+
+
+def levenshtein(a: str, b: str, max_dist: int = None) -> int:
+    """Edit distance; with max_dist, gives up early and returns max_dist + 1."""
+    if len(a) < len(b):
+        a, b = b, a
+    if max_dist is not None and len(a) - len(b) > max_dist:
+        return max_dist + 1
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        if max_dist is not None and min(cur) > max_dist:
+            return max_dist + 1
+        prev = cur
+    return prev[-1]
+
+
+def _grams(word: str) -> set:
+    padded = f"##{word}#"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NGramIndex:
+    """Trigram inverted index over alias keys for bounded edit-distance search."""
+
+    def __init__(self, keys):
+        self.keys = sorted(keys)
+        self.postings = defaultdict(list)
+        for i, k in enumerate(self.keys):
+            for g in _grams(k):
+                self.postings[g].append(i)
+
+    def search(self, word: str, max_dist: int) -> List[Tuple[int, str]]:
+        grams = _grams(word)
+        # One edit destroys at most 3 trigrams; fewer shared ones cannot match
+        need = len(grams) - 3 * max_dist
+        if need > 0:
+            counts = defaultdict(int)
+            for g in grams:
+                for i in self.postings.get(g, ()):
+                    counts[i] += 1
+            candidates = [self.keys[i] for i, c in counts.items() if c >= need]
+        else:
+            candidates = self.keys
+        found = []
+        for k in candidates:
+            if abs(len(k) - len(word)) > max_dist:
+                continue
+            d = levenshtein(word, k, max_dist)
+            if d <= max_dist:
+                found.append((d, k))
+        return sorted(found)
+
+
+def _load_vocab(path: str = VOCAB_PATH):
+    with open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    tests, aliases = {}, {}
+    for e in entries:
+        tests[e["id"]] = {"name": e["name"], "units": {u.lower() for u in e.get("units", [])}}
+        for alias in [e["name"]] + e.get("aliases", []):
+            k = _key(alias)
+            if k and k not in aliases:
+                aliases[k] = e["id"]
+    return tests, aliases, NGramIndex(aliases)
+
+
+TESTS, ALIASES, INDEX = _load_vocab()
+
+
+def _max_distance(key: str) -> int:
+    # Short abbreviations (MCV/MCH, T3/T4) must match exactly
+    if len(key) <= 4:
+        return 0
+    return 1 if len(key) <= 8 else 2
+
+
+def _fuzzy(key: str, unit: str, max_dist: int = 2) -> Optional[Tuple[str, int]]:
+    max_dist = min(max_dist, _max_distance(key))
+    if max_dist == 0:
+        return None
+    matches = INDEX.search(key, max_dist)
+    if not matches:
+        return None
+    # Among the closest aliases prefer a test whose expected units include this one
+    best = min(matches, key=lambda m: (m[0], unit not in TESTS[ALIASES[m[1]]]["units"]))
+    return ALIASES[best[1]], best[0]
+
+
+def _trailing_ngrams(key: str) -> List[str]:
+    """Trailing word n-grams, longest first, stopping at the first qualifier word."""
+    words = key.split()
+    grams = []
+    for n in range(len(words) - 1, 0, -1):
+        if words[-n - 1] in QUALIFIERS:
+            break
+        if n <= MAX_NGRAM:
+            grams.append(" ".join(words[-n:]))
+    return grams
+
+
+@lru_cache(maxsize=4096)
+def _lookup_key(key: str, unit: str) -> Optional[Tuple[str, int]]:
+    """key: label with parentheticals already removed, then normalized."""
+    core = _strip_leading_numbers(key)
+    if not core:
+        return None
+    if core in ALIASES:
+        return ALIASES[core], 0
+    # Noisy labels carry neighbouring text: "sex m ... haematology haemoglobin"
+    ngrams = [g for g in _trailing_ngrams(core) if len(g) >= MIN_NGRAM_KEY]
+    for g in ngrams:
+        if g in ALIASES:
+            return ALIASES[g], 0
+    hit = _fuzzy(core, unit)
+    if hit:
+        return hit
+    # A fragment of a longer label gets one edit at most ("total le" is not "total t3")
+    for g in ngrams:
+        hit = _fuzzy(g, unit, max_dist=1)
+        if hit:
+            return hit
+    return None
+
+
+def lookup(name: str, unit: str = "") -> Optional[Dict[str, Any]]:
+    """Map a raw (possibly OCR-noisy) test name to its canonical vocabulary entry."""
+    unit = (unit or "").strip().lower()
+    hit = None
+    for key in dict.fromkeys((_key(name), _key(_strip_parentheticals(name)))):
+        if key:
+            hit = _lookup_key(key, unit)
+            if hit:
+                break
+    if hit is None:
+        return None
+    test_id, distance = hit
+    return {"id": test_id, "name": TESTS[test_id]["name"], "distance": distance}
+
+
+def normalize_tests(tests: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Rename extracted tests to canonical names, recording canonical_id and
+    match_distance. The label as printed is kept in raw_name.
+    """
+    for t in tests:
+        hit = lookup(t.get("name", ""), t.get("unit", ""))
+        if hit:
+            t.setdefault("raw_name", t.get("name"))
+            t["name"] = hit["name"]
+            t["canonical_id"] = hit["id"]
+            t["match_distance"] = hit["distance"]
+    return tests
@@ -0,0 +1,8 @@
+def init_worker():
+    """
+    Process-pool initializer: one torch intra-op thread per worker process.
+    Pools already run one worker per core; full-width torch pools in every
+    worker oversubscribe the CPU and slow all of them down.
+    """
+    import torch
+    torch.set_num_threads(1)
@@ -6,6 +6,7 @@ const reportImageContainer = document.getElementById("reportImageContainer");
 const evalOutput = document.getElementById("evalOutput");
 const progressSection = document.getElementById("progressSection");
 const progressFill = document.getElementById("progressFill");
+const evaluateBtn = document.getElementById("evaluateBtn");
 const hitlForm = document.getElementById("hitlForm");
 const saveBtn = document.getElementById("saveBtn");
 
@@ -156,13 +157,17 @@ uploadForm.addEventListener("submit", async (e) => {
       reportImageContainer.innerHTML = "";
       data.images.forEach((img, index) => {
         const figure = document.createElement("figure");
+        const link = document.createElement("a");
+        link.href = `${API_URL}${img.image}`;
+        link.target = "_blank";
         const image = document.createElement("img");
-        image.src = `${API_URL}${img.image}`;
+        image.src = `${API_URL}${img.image}?format=webp&max_side=1600`;
         image.alt = `Annotated page ${index + 1}`;
+        link.appendChild(image);
         const caption = document.createElement("figcaption");
         const label = img.filename ? `Page ${index + 1}: ${img.filename}` : `Page ${index + 1}`;
         caption.textContent = label;
-        figure.appendChild(image);
+        figure.appendChild(link);
         figure.appendChild(caption);
         reportImageContainer.appendChild(figure);
       });
@@ -217,3 +222,35 @@ saveBtn.addEventListener("click", async () => {
     alert("❌ Error: " + result.detail);
   }
 });
+
+// Evaluation runs as a background job; poll until it finishes
+evaluateBtn.addEventListener("click", async () => {
+  evaluateBtn.disabled = true;
+  evalOutput.textContent = "⏳ Evaluation running...";
+  try {
+    let res = await fetch(`${API_URL}/evaluate`, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({})
+    });
+    let job = await res.json();
+    if (!res.ok) throw new Error(job.detail || "Evaluation failed");
+
+    while (job.status === "running") {
+      await new Promise(resolve => setTimeout(resolve, 2000));
+      res = await fetch(`${API_URL}/evaluate/${job.id}`);
+      job = await res.json();
+    }
+
+    const pre = document.createElement("pre");
+    pre.textContent = job.status === "done"
+      ? JSON.stringify(job.result.variants, null, 2)
+      : "❌ Error: " + job.error;
+    evalOutput.innerHTML = "";
+    evalOutput.appendChild(pre);
+  } catch (err) {
+    evalOutput.textContent = "❌ Error: " + err.message;
+  } finally {
+    evaluateBtn.disabled = false;
+  }
+});
@@ -0,0 +1,67 @@
+import pytest
+
+from src import templates
+
+
+@pytest.fixture(autouse=True)
+def template_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(templates, "TEMPLATE_DIR", str(tmp_path))
+    monkeypatch.setattr(templates, "_templates", None)
+    monkeypatch.setattr(templates, "STATS", {"hits": 0, "misses": 0})
+
+
+def tok(text, x, y, w=0.08):
+    return {"text": text, "bbox": [x, y, x + w, y + 0.02], "confidence": 0.9}
+
+
+def page(name, rows):
+    """Same lab letterhead; rows of (label words, value, unit) at fixed positions."""
+    tokens = [tok("City", 0.1, 0.02), tok("Diagnostics", 0.2, 0.02), tok("Laboratory", 0.35, 0.02),
+              tok("Patient", 0.1, 0.1), tok(name, 0.3, 0.1)]
+    for i, (label, value, unit) in enumerate(rows):
+        y = 0.4 + i * 0.05
+        for j, word in enumerate(label.split()):
+            tokens.append(tok(word, 0.05 + j * 0.1, y))
+        tokens += [tok(value, 0.5, y), tok(unit, 0.65, y)]
+    return tokens
+
+
+CBC = [("Hemoglobin", "13.5", "g/dL"), ("WBC Count", "7200", "/cumm")]
+CORRECTED = {
+    "patient": {"name": "Smith"},
+    "tests": [{"name": "Hemoglobin", "value": "13.5", "unit": "g/dL"},
+              {"name": "WBC Count", "value": "7200", "unit": "/cumm"}],
+}
+
+
+def test_same_layout_is_extracted_from_template():
+    assert templates.learn_template(page("Smith", CBC), CORRECTED)
+    got = templates.extract_from_template(page("Jones", [("Hemoglobin", "11.9", "g/dL"), ("WBC Count", "8100", "/cumm")]))
+    assert got is not None
+    assert [(t["name"], t["value"]) for t in got["tests"]] == [("Hemoglobin", "11.9"), ("WBC Count", "8100")]
+    assert templates.STATS["hits"] == 1
+
+
+def test_other_panel_with_same_header_is_a_miss():
+    assert templates.learn_template(page("Smith", CBC), CORRECTED)
+    lipid = page("Jones", [("Total Cholesterol", "210", "mg/dl"), ("Triglycerides", "150", "mg/dl")])
+    assert templates.extract_from_template(lipid) is None
+    assert templates.STATS["misses"] == 1
+
+
+def test_mismatched_rows_are_dropped():
+    assert templates.learn_template(page("Smith", CBC), CORRECTED)
+    got = templates.extract_from_template(page("Jones", [("Hemoglobin", "12.4", "g/dL"), ("Triglycerides", "150", "mg/dl")]))
+    assert [t["name"] for t in got["tests"]] == ["Hemoglobin"]
+
+
+def test_header_signature_excludes_patient_name():
+    tokens = page("Smith", CBC)
+    assert not any("smith" in w for w in templates.header_signature(tokens, exclude={4}))
+
+
+def test_uncounted_extraction_leaves_stats_alone():
+    assert templates.learn_template(page("Smith", CBC), CORRECTED)
+    templates.extract_from_template(page("Jones", CBC), count=False)
+    templates.extract_from_template([], count=False)
+    assert templates.STATS == {"hits": 0, "misses": 0}
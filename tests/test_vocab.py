@@ -0,0 +1,66 @@
+from src.vocab import _key, _strip_leading_numbers, levenshtein, lookup, normalize_tests
+
+
+def test_key_drops_punctuation_and_specimen_words():
+    assert _key("Creatinine - Serum") == "creatinine"
+    assert _key("PCV/HAEMATOCRIT") == "pcv haematocrit"
+
+
+def test_strip_leading_numbers():
+    assert _strip_leading_numbers("40 54 mcv") == "mcv"
+    assert _strip_leading_numbers("0 13 pcv haematocrit") == "pcv haematocrit"
+    assert _strip_leading_numbers("5 10") == ""
+
+
+def test_levenshtein():
+    assert levenshtein("hemoglobin", "hemog1obin") == 1
+    assert levenshtein("", "abc") == 3
+    assert levenshtein("kitten", "sitting") == 3
+
+
+def test_levenshtein_gives_up_past_max_dist():
+    assert levenshtein("kitten", "sitting", max_dist=1) == 2
+    assert levenshtein("a", "abcdef", max_dist=2) == 3
+
+
+def test_lookup_strips_parentheticals():
+    assert lookup("Creatinine (Cr)")["id"] == "creatinine"
+    assert lookup("Total Cholesterol (TC)")["id"] == "cholesterol_total"
+
+
+def test_lookup_skips_reference_ranges():
+    assert lookup("40-54 MCV")["id"] == "mcv"
+    assert lookup("0-13 PCV/HAEMATOCRIT")["id"] == "hematocrit"
+
+
+def test_lookup_trailing_ngram():
+    hit = lookup("Sex M Company Test Name Value Unit HAEMATOLOGY HAEMOGLOBIN")
+    assert hit["id"] == "hemoglobin"
+    assert hit["distance"] == 0
+
+
+def test_lookup_fuzzy():
+    hit = lookup("Hemog1obin")
+    assert hit["id"] == "hemoglobin"
+    assert hit["distance"] == 1
+
+
+def test_lookup_misses():
+    assert lookup("Fax") is None
+    assert lookup("- 4. 00 4. 0 - 5. 5 total le") is None
+    assert lookup("") is None
+
+
+def test_lookup_qualified_labels_are_not_their_trailing_test():
+    for name in ["Non HDL Cholesterol", "Urine Glucose", "Estimated Average Glucose",
+                 "Mean Blood Glucose", "Urine RBC", "Urine Creatinine", "Ionized Calcium"]:
+        assert lookup(name) is None, name
+
+
+def test_normalize_tests_keeps_raw_name():
+    tests = normalize_tests([{"name": "HAEMOGLOBIN", "value": "13.5", "unit": "g/dl"},
+                             {"name": "Urine Glucose", "value": "Nil", "unit": ""}])
+    assert tests[0]["name"] == "Hemoglobin"
+    assert tests[0]["raw_name"] == "HAEMOGLOBIN"
+    assert tests[1]["name"] == "Urine Glucose"
+    assert "canonical_id" not in tests[1]